@@ -1,51 +1,125 @@
 from __future__ import annotations
 
+import datetime
+import decimal
 import enum
+import hashlib
+import io
 import logging
 import re
+import sys
+import threading
 import uuid
+import weakref
 from abc import ABC, abstractmethod
 from collections.abc import Collection, Mapping
 from dataclasses import dataclass
 from typing import Optional, Callable, Union, Any, Dict
 
 import psycopg2
+import psycopg2.extensions as extensions
 import psycopg2.extras as extras
+import psycopg2.pool as pool
+import psycopg2.sql as pgsql
 
 logger = logging.getLogger(__name__)
 
+# names of the statements prepared on each connection
+_prepared: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
-def _serialize_value(value: Any):
-    if isinstance(value, uuid.UUID):
-        return str(value)
-    if isinstance(value, enum.Enum):
-        return value.value
-    return value
+
+def _adapt_enum(value: enum.Enum):
+    return extensions.adapt(value.value)
+
+
+# registered once for all connections; Enum subclasses are found through their superclass
+extensions.register_adapter(uuid.UUID, extras.UUID_adapter)
+extensions.register_adapter(enum.Enum, _adapt_enum)
+
+
+def _log_query(cursor, query: pgsql.Composable):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Executing query: %s", query.as_string(cursor))
+
+
+def _identifiers(keys: Collection[str]) -> pgsql.Composable:
+    return pgsql.SQL(',').join(map(pgsql.Identifier, keys))
 
 
-def _serialize(dict_: Mapping[str, Any]):
-    return {key: _serialize_value(value) for key, value in dict_.items()}
+# values COPY reads back correctly from their text form
+_COPY_TYPES = frozenset([
+    type(None), str, int, float, bool, decimal.Decimal, uuid.UUID,
+    datetime.date, datetime.datetime, datetime.time,
+])
 
 
-def insert(cursor, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+def _copyable(value: Any) -> bool:
+    if isinstance(value, enum.Enum):
+        value = value.value
+    return type(value) in _COPY_TYPES
+
+
+def _copy_field(value: Any) -> str:
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if value is None:
+        return ''
+    if type(value) is bool:
+        # the same text a bool parameter becomes in an INSERT
+        return 'true' if value else 'false'
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_insert(cursor, table: str, keys: Collection[str], values: Collection[Mapping[str, Any]]):
+    buffer = io.StringIO()
+    for dict_ in values:
+        buffer.write(','.join(_copy_field(dict_[key]) for key in keys))
+        buffer.write('\n')
+    buffer.seek(0)
+    # noinspection SqlResolve,SqlNoDataSourceInspection
+    query = pgsql.SQL('COPY {table} ({columns}) FROM STDIN WITH (FORMAT CSV)').format(
+        table=pgsql.Identifier(table), columns=_identifiers(keys))
+    _log_query(cursor, query)
+    cursor.copy_expert(query, buffer)
+
+
+def insert(cursor,
+           table: str,
+           values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+           *,
+           copy: bool = False,
+           copy_threshold: Optional[int] = None,
+           page_size: int = 1000):
     if not values:
         return
     if isinstance(values, Mapping):
         values = [values]
-    keys = values[0].keys()
-    insertion_points = ','.join([f'"{key}"' for key in keys])
+    keys = tuple(values[0].keys())
+    if not copy and copy_threshold is not None and len(values) >= copy_threshold:
+        # COPY cannot write to views and bypasses ON INSERT rules, hence only on request
+        copy = all(_copyable(value) for dict_ in values for value in dict_.values())
+    if copy:
+        _copy_insert(cursor, table, keys, values)
+        return
     insertion_pattern = '(' + ','.join(f"%({key})s" for key in keys) + ')'
-    values = ','.join(
-        cursor.mogrify(insertion_pattern, _serialize(dict_)).decode('utf8') for dict_ in values)
     # noinspection SqlResolve,SqlNoDataSourceInspection
-    query = f'INSERT INTO "{table}" ({insertion_points}) VALUES {values}'
-    logger.debug(f"Executing query: {query}")
-    cursor.execute(query)
+    query = pgsql.SQL('INSERT INTO {table} ({columns}) VALUES %s').format(
+        table=pgsql.Identifier(table), columns=_identifiers(keys))
+    _log_query(cursor, query)
+    extras.execute_values(cursor, query, values, template=insertion_pattern, page_size=page_size)
 
 
 class Select:
-    def __init__(self, parent: Union[Database, Session, Transaction], query: str, *args, **kwargs):
+    def __init__(self,
+                 parent: Union[Database, Session, Transaction],
+                 query: str,
+                 *args,
+                 **kwargs):
         self._query: str = query
+        self._arraysize = None
+        self._stream = False
+        self._itersize = None
+        self._readonly = query.lstrip().upper().startswith(("SELECT", "WITH"))
         if args:
             self._args = args
         elif kwargs:
@@ -53,50 +127,90 @@ class Select:
         else:
             self._args = None
         self._parent = parent
-        self._session = None
-        self._transaction = None
+        self._stack = []
         self._cursor = None
 
+    # options are set here rather than in __init__, where keyword arguments are query parameters
+    def configure(self,
+                  *,
+                  arraysize: Optional[int] = None,
+                  stream: Optional[bool] = None,
+                  itersize: Optional[int] = None,
+                  readonly: Optional[bool] = None) -> Select:
+        if arraysize is not None:
+            self._arraysize = arraysize
+        if stream is not None:
+            self._stream = stream
+        if itersize is not None:
+            self._itersize = itersize
+        if readonly is not None:
+            self._readonly = readonly
+        return self
+
     def __iter__(self):
         logger.debug(f"Executing query {self._query} with args: {self._args}")
         self._cursor.execute(self._query, self._args)
-        return self
-
-    def __next__(self):
-        res = self._cursor.fetchone()
-        if res is None:
-            raise StopIteration
-        return res
+        if self._stream:
+            yield from self._cursor
+            return
+        arraysize = self._arraysize or 1000
+        while True:
+            rows = self._cursor.fetchmany(arraysize)
+            if not rows:
+                return
+            yield from rows
+
+    def _open_cursor(self, transaction: Transaction):
+        # a select gets a cursor of its own, so that other statements can run while it is iterated
+        if not self._stream:
+            return transaction.open_cursor()
+        # a named cursor is kept on the server and fetched itersize rows at a time
+        cur = transaction.open_cursor(name=f"ep_{uuid.uuid4().hex}")
+        cur.itersize = self._itersize or 2000
+        return cur
+
+    def _autocommit(self) -> bool:
+        # only a session opened by this select can skip the transaction;
+        # named cursors for streaming need one
+        # noinspection PyProtectedMember
+        return isinstance(self._parent, Database) and self._parent._autocommit_reads \
+            and self._readonly and not self._stream
 
     def __enter__(self):
-        if isinstance(self._parent, Database):
-            self._session = self._parent.__enter__()
-            self._transaction = self._session.__enter__()
-            self._cursor = self._transaction.cursor()
-        elif isinstance(self._parent, Session):
-            self._transaction = self._parent.__enter__()
-            self._cursor = self._transaction.cursor()
-        elif isinstance(self._parent, Transaction):
-            self._cursor = self._parent.cursor()
-        self._cursor.__enter__()
+        parent = self._parent
+        autocommit = self._autocommit()
+        self._stack = []
+        try:
+            # open Database -> Session -> Transaction as far as needed
+            while not isinstance(parent, Transaction):
+                if autocommit and isinstance(parent, Session):
+                    child = parent.begin(autocommit=True)
+                else:
+                    child = parent.__enter__()
+                self._stack.append(parent)
+                parent = child
+            self._cursor = self._open_cursor(parent)
+            self._stack.append(self._cursor)
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    @staticmethod
+    def _unwind(stack, exc_type, exc_val, exc_tb):
+        # nested try/finally so that a failure while closing one level is chained into the next
+        if not stack:
+            return
         try:
-            self._cursor.__exit__(exc_type, exc_val, exc_tb)
+            stack[-1].__exit__(exc_type, exc_val, exc_tb)
         finally:
-            try:
-                if isinstance(self._parent, Database):
-                    try:
-                        self._transaction.__exit__(exc_type, exc_val, exc_tb)
-                    finally:
-                        self._session.__exit__(exc_type, exc_val, exc_tb)
-                elif isinstance(self._parent, Session):
-                    self._parent.__exit__(exc_type, exc_val, exc_tb)
-            finally:
-                self._session = None
-                self._transaction = None
-                self._cursor = None
+            Select._unwind(stack[:-1], exc_type, exc_val, exc_tb)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stack = self._stack
+        self._stack = []
+        self._cursor = None
+        self._unwind(stack, exc_type, exc_val, exc_tb)
 
 
 class SelectMock(Select):
@@ -124,7 +238,12 @@ class Queryable(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def insert(self, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+    def insert(self,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
         raise NotImplementedError
 
     @abstractmethod
@@ -138,15 +257,20 @@ class Queryable(ABC):
 
 class QueryableMock(Queryable):
     def __init__(self, fakes: Dict[str, Collection[Collection]]):
-        self._fakes = fakes
+        self._fakes = [(re.compile(k), v) for k, v in fakes.items()]
 
     def select(self, query, *args, **kwargs) -> Select:
-        for k, v in self._fakes.items():
-            if re.match(k, query):
+        for pattern, v in self._fakes:
+            if pattern.match(query):
                 return SelectMock(v)
         return SelectMock([])
 
-    def insert(self, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+    def insert(self,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
         # don't do anything
         pass
 
@@ -163,21 +287,31 @@ class Credentials:
     hostname: str = 'localhost'
     port: int = 5432
 
+    def as_kwargs(self) -> Dict[str, Any]:
+        return {
+            'dbname': self.database,
+            'user': self.username,
+            'password': self.password,
+            'host': self.hostname,
+            'port': self.port,
+        }
+
     def __str__(self):
-        return f"dbname={self.database}" \
-               f" user={self.username}" \
-               f" password={self.password}" \
-               f" host={self.hostname}" \
-               f" port={self.port}"
+        return extensions.make_dsn(**self.as_kwargs())
 
 
 class Database(Queryable):
     def select(self, query, *args, **kwargs) -> Select:
         return Select(self, query, *args, **kwargs)
 
-    def insert(self, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+    def insert(self,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
         with self as session:
-            session.insert(table, values)
+            session.insert(table, values, copy=copy, copy_threshold=copy_threshold)
 
     def execute(self, sql: str, *args, **kwargs):
         with self as session:
@@ -189,34 +323,66 @@ class Database(Queryable):
                  *,
                  credentials: Optional[Credentials] = None,
                  connection_string: Optional[str] = None,
-                 connection_factory: Optional[Callable] = None):
+                 connection_factory: Optional[Callable] = None,
+                 pool_size: Optional[int] = None,
+                 max_pool: int = 10,
+                 autocommit_reads: bool = False):
         if isinstance(arg, Credentials):
             credentials = arg
         elif isinstance(arg, str):
             connection_string = arg
         elif isinstance(arg, Callable):
             connection_factory = arg
+        connect_kwargs = None
         if credentials is not None:
-            connection_string = str(credentials)
-        if connection_string is not None:
-            connection_factory = lambda: psycopg2.connect(connection_string)
+            connect_kwargs = credentials.as_kwargs()
+        elif connection_string is not None:
+            connect_kwargs = {'dsn': connection_string}
+        self._pool = None
+        if pool_size is not None:
+            if connect_kwargs is None:
+                raise ValueError("pool_size requires credentials or a connection_string")
+            if pool_size > max_pool:
+                raise ValueError(f"pool_size ({pool_size}) must not exceed max_pool ({max_pool})")
+            self._pool = pool.ThreadedConnectionPool(minconn=pool_size, maxconn=max_pool, **connect_kwargs)
+        if connect_kwargs is not None:
+            connection_factory = lambda: psycopg2.connect(**connect_kwargs)
         if connection_factory is None:
             raise ValueError("no credentials, connection_string, or connection_factory given")
         self._connection_factory = connection_factory
+        self._autocommit_reads = autocommit_reads
+        self._local = threading.local()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+    def connect(self) -> Session:
+        if self._pool is not None:
+            conn = self._pool.getconn()
+        else:
+            conn = self._connection_factory()
+            if isinstance(conn, str):
+                conn = psycopg2.connect(conn)
+        return Session(conn)
+
+    def release(self, session: Session):
+        # noinspection PyProtectedMember
+        conn = session._conn
+        if self._pool is not None:
+            self._pool.putconn(conn)
+        else:
+            conn.close()
 
     def __enter__(self) -> Session:
-        conn = self._connection_factory()
-        if isinstance(conn, str):
-            conn = psycopg2.connect(conn)
-        self._session = Session(conn)
-        return self._session
+        self._local.session = self.connect()
+        return self._local.session
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            # noinspection PyProtectedMember
-            self._session._conn.close()
+            self.release(self._local.session)
         finally:
-            self._session = None
+            self._local.session = None
 
     @staticmethod
     def mock(fakes: Dict[str, Collection[Collection]] = dict()) -> Database:
@@ -225,35 +391,69 @@ class Database(Queryable):
 
 
 class GlobalSession(Queryable):
+    __lock = threading.Lock()
+    __local = threading.local()
     __database = None
-    __session = None
     __args = []
     __kwargs = {}
 
     def __init__(self, *args, **kwargs):
         if args or kwargs:
-            if GlobalSession.__database is not None:
-                GlobalSession.__database.__exit__(None, None, None)
-                GlobalSession.__session = None
-            GlobalSession.__args = args
-            GlobalSession.__kwargs = kwargs
+            with GlobalSession.__lock:
+                if GlobalSession.__database is not None:
+                    GlobalSession.release()
+                    GlobalSession.__database.close()
+                    GlobalSession.__database = None
+                GlobalSession.__args = args
+                GlobalSession.__kwargs = kwargs
 
     @classmethod
     def get(cls) -> Session:
-        if cls.__database is None:
-            cls.__database = Database(*cls.__args, **cls.__kwargs)
-            cls.__session = cls.__database.__enter__()
-        return cls.__session
+        local = cls.__local
+        session = getattr(local, 'session', None)
+        if session is not None and local.database is not cls.__database:
+            # sessions of a database replaced by reconfiguring are dropped
+            cls.release()
+            session = None
+        if session is None:
+            with cls.__lock:
+                if cls.__database is None:
+                    cls.__database = Database(*cls.__args, **cls.__kwargs)
+                local.database = cls.__database
+            local.session = session = local.database.connect()
+        return session
+
+    @classmethod
+    def release(cls):
+        # Hands the calling thread's connection back. A thread that ends without calling this
+        # keeps its pooled connection checked out, and max_pool such threads exhaust the pool.
+        local = cls.__local
+        session = getattr(local, 'session', None)
+        database = getattr(local, 'database', None)
+        local.session = None
+        local.database = None
+        if session is None:
+            return
+        if database is cls.__database:
+            database.release(session)
+        else:
+            # the database was replaced by reconfiguring and its pool (if any) is closed already
+            # noinspection PyProtectedMember
+            session._conn.close()
 
     @classmethod
     def select(cls, query, *args, **kwargs) -> Select:
         return Select(cls.get(), query, *args, **kwargs)
 
     @classmethod
-    def insert(cls, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+    def insert(cls,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
         with cls.get() as transaction:  # pylint: disable=E1129
-            with transaction.cursor() as cur:
-                insert(cur, table, values)
+            insert(transaction.cursor(), table, values, copy=copy, copy_threshold=copy_threshold)
 
     @classmethod
     def execute(cls, sql: str, *args, **kwargs):
@@ -265,10 +465,14 @@ class Session(Queryable):
     def select(self, query, *args, **kwargs) -> Select:
         return Select(self, query, *args, **kwargs)
 
-    def insert(self, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
+    def insert(self,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
         with self as transaction:
-            with transaction.cursor() as cur:
-                insert(cur, table, values)
+            insert(transaction.cursor(), table, values, copy=copy, copy_threshold=copy_threshold)
 
     def execute(self, sql: str, *args, **kwargs):
         with self as transaction:
@@ -277,19 +481,35 @@ class Session(Queryable):
     def __init__(self, conn):
         self._conn = conn
         self._transaction = None
+        self._autocommit = False
 
-    def __enter__(self) -> Transaction:
+    def begin(self, autocommit: bool = False) -> Transaction:
         assert self._transaction is None
-        self._conn.__enter__()
+        if autocommit:
+            # every statement commits on its own, no BEGIN/COMMIT round-trips
+            self._conn.autocommit = True
+        else:
+            self._conn.__enter__()
+        self._autocommit = autocommit
         self._transaction = Transaction(self._conn)
         return self._transaction
 
+    def __enter__(self) -> Transaction:
+        return self.begin()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         assert self._transaction is not None
         try:
-            self._conn.__exit__(exc_type, exc_val, exc_tb)
+            try:
+                self._transaction.close()
+            finally:
+                if self._autocommit:
+                    self._conn.autocommit = False
+                else:
+                    self._conn.__exit__(exc_type, exc_val, exc_tb)
         finally:
             self._transaction = None
+            self._autocommit = False
 
     @staticmethod
     def mock(fakes: Dict[str, Collection[Collection]] = dict()) -> Session:
@@ -298,53 +518,93 @@ class Session(Queryable):
 
 
 class Transaction(Queryable):
+    def open_cursor(self, name: Optional[str] = None):
+        return self._conn.cursor(name)
+
     def cursor(self):
-        return self._conn.cursor()
+        # shared by the statements run on this transaction; they consume their results right away
+        if self._cached_cur is None or self._cached_cur.closed:
+            self._cached_cur = self._conn.cursor()
+        return self._cached_cur
 
     def select(self, query, *args, **kwargs) -> Select:
         return Select(self, query, *args, **kwargs)
 
-    def insert(self, table: str, values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]]):
-        with self._conn.cursor() as cur:
-            insert(cur, table, values)
+    def insert(self,
+               table: str,
+               values: Union[Collection[Mapping[str, Any]], Mapping[str, Any]],
+               *,
+               copy: bool = False,
+               copy_threshold: Optional[int] = None):
+        insert(self.cursor(), table, values, copy=copy, copy_threshold=copy_threshold)
 
     def execute(self, sql: str, *args, **kwargs):
         with self as cur:
             cur.execute(sql, *args, **kwargs)
 
+    def prepared(self, sql: str) -> str:
+        # PREPAREs sql once per connection and returns an EXECUTE taking the same arguments
+        name = 'p_' + hashlib.sha1(sql.encode('utf8')).hexdigest()
+        placeholders = []
+
+        def placeholder(match):
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(0) != '%s':
+                raise ValueError("only positional %s placeholders can be prepared")
+            placeholders.append('%s')
+            return f'${len(placeholders)}'
+
+        statement = re.sub(r'%(?:\([^)]*\))?.', placeholder, sql)
+        names = _prepared.setdefault(self._conn, set())
+        if name not in names:
+            self.cursor().execute(f'PREPARE {name} AS {statement}')
+            names.add(name)
+        if not placeholders:
+            return f'EXECUTE {name}'
+        return f'EXECUTE {name}({",".join(placeholders)})'
+
     def rollback(self):
         self._conn.rollback()
 
     def commit(self):
         self._conn.commit()
 
+    def close(self):
+        if self._cached_cur is not None:
+            try:
+                self._cached_cur.close()
+            finally:
+                self._cached_cur = None
+
     def __init__(self, conn):
         self._conn = conn
         self._cursor = None
+        self._cached_cur = None
 
     def __enter__(self):
         assert self._cursor is None
-        cur = self._conn.cursor()
-        self._cursor = Cursor(cur)
-        # noinspection PyProtectedMember
-        self._cursor._cur.__enter__()
+        self._cursor = Cursor(self.cursor())
         return self._cursor
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         assert self._cursor is not None
-        try:
-            # noinspection PyProtectedMember
-            self._cursor._cur.__exit__(exc_type, exc_val, exc_tb)
-        finally:
-            self._cursor = None
+        # the underlying cursor is kept open for reuse until the transaction ends
+        self._cursor = None
 
 
 class Cursor:
     def execute(self, sql: str, *args, **kwargs):
         self._cur.execute(sql, *args, **kwargs)
 
-    def execute_batch(self, sql: str, *args, **kwargs):
-        extras.execute_batch(self._cur, sql, *args, **kwargs)
+    def executemany(self, sql: str, argslist, page_size: int = 500):
+        self.execute_batch(sql, argslist, page_size=page_size)
+
+    def execute_batch(self, sql: str, argslist, page_size: int = 500):
+        extras.execute_batch(self._cur, sql, argslist, page_size=page_size)
+
+    def execute_values(self, sql: str, argslist, template: Optional[str] = None, page_size: int = 500):
+        extras.execute_values(self._cur, sql, argslist, template=template, page_size=page_size)
 
     def __init__(self, cur):
         self._cur = cur
@@ -1,19 +1,16 @@
-import re
-
 import setuptools
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
-    start_result = re.search(r"<!-- START doctoc [^>]+-->", long_description)
-    if start_result:
-        pos = start_result.span(0)[0]
-        before = long_description[:pos]
-        remaining = long_description[pos:]
-        end_result = re.search(r"<!-- END doctoc [^>]+-->", remaining)
-        end_pos = end_result.span(0)[1]
-        after = remaining[end_pos:]
-        long_description = before + after
+    start = long_description.find("<!-- START doctoc ")
+    if start != -1:
+        end = long_description.find("<!-- END doctoc ", start)
+        if end != -1:
+            end = long_description.find("-->", end)
+        if end == -1:
+            raise ValueError("README.md has a doctoc START marker without a matching END marker")
+        long_description = long_description[:start] + long_description[end + len("-->"):]
 
 __pkginfo__ = {}
 with open("easypsyco/__pkginfo__.py") as fh:
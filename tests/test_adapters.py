@@ -0,0 +1,39 @@
+import enum
+import unittest
+import uuid
+
+from psycopg2.extensions import adapt
+
+import easypsyco  # registers the adapters  # pylint: disable=W0611
+
+
+class Color(enum.Enum):
+    RED = 1
+
+
+class Name(enum.Enum):
+    ALICE = 'alice'
+
+
+class Size(enum.IntEnum):
+    LARGE = 3
+
+
+class AdaptersTestCase(unittest.TestCase):
+    def test_enum(self):
+        self.assertEqual(b'1', adapt(Color.RED).getquoted())
+
+    def test_str_enum(self):
+        self.assertEqual(b"'alice'", adapt(Name.ALICE).getquoted())
+
+    def test_int_enum(self):
+        # found through int in the MRO, before Enum
+        self.assertEqual(b'3', adapt(Size.LARGE).getquoted())
+
+    def test_uuid(self):
+        value = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        self.assertEqual(b"'12345678-1234-5678-1234-567812345678'::uuid", adapt(value).getquoted())
+
+
+if __name__ == '__main__':
+    unittest.main()
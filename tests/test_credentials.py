@@ -0,0 +1,21 @@
+import unittest
+
+from psycopg2.extensions import parse_dsn
+
+import easypsyco
+
+
+class CredentialsTestCase(unittest.TestCase):
+    def test_dsn_escapes_values(self):
+        credentials = easypsyco.Credentials(username='user', password="it's a secret", database='db')
+        self.assertEqual({
+            'dbname': 'db',
+            'user': 'user',
+            'password': "it's a secret",
+            'host': 'localhost',
+            'port': '5432',
+        }, parse_dsn(str(credentials)))
+
+
+if __name__ == '__main__':
+    unittest.main()
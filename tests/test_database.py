@@ -0,0 +1,84 @@
+import threading
+import unittest
+from unittest import mock
+
+import easypsyco
+
+from .test_select import FakeConnection
+
+
+class PoolTestCase(unittest.TestCase):
+    def test_pool_size_must_not_exceed_max_pool(self):
+        with self.assertRaises(ValueError):
+            easypsyco.Database("dbname=test", pool_size=20, max_pool=10)
+
+    def test_pooled_connections_are_reused(self):
+        connections = []
+
+        def connect(*args, **kwargs):
+            connections.append(FakeConnection())
+            return connections[-1]
+
+        with mock.patch('psycopg2.connect', connect):
+            db = easypsyco.Database("dbname=test", pool_size=1, max_pool=2)
+            self.assertEqual(1, len(connections))
+            with db as session:
+                # noinspection PyProtectedMember
+                self.assertIs(connections[0], session._conn)
+            self.assertFalse(connections[0].closed)
+            with db as session:
+                # noinspection PyProtectedMember
+                self.assertIs(connections[0], session._conn)
+            self.assertEqual(1, len(connections))
+            db.close()
+            self.assertTrue(connections[0].closed)
+
+
+class GlobalSessionTestCase(unittest.TestCase):
+    def tearDown(self):
+        easypsyco.GlobalSession.release()
+
+    @staticmethod
+    def _in_thread(function):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(function()))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def test_one_session_per_thread(self):
+        easypsyco.GlobalSession(connection_factory=FakeConnection)
+        session = easypsyco.GlobalSession.get()
+        self.assertIs(session, easypsyco.GlobalSession.get())
+        self.assertIsNot(session, self._in_thread(easypsyco.GlobalSession.get))
+
+    def test_release(self):
+        easypsyco.GlobalSession(connection_factory=FakeConnection)
+        session = easypsyco.GlobalSession.get()
+        easypsyco.GlobalSession.release()
+        # noinspection PyProtectedMember
+        self.assertTrue(session._conn.closed)
+        self.assertIsNot(session, easypsyco.GlobalSession.get())
+
+    def test_stale_session_is_dropped(self):
+        easypsyco.GlobalSession(connection_factory=FakeConnection)
+        session = easypsyco.GlobalSession.get()
+        self._in_thread(lambda: easypsyco.GlobalSession(connection_factory=FakeConnection))
+        self.assertIsNot(session, easypsyco.GlobalSession.get())
+        # noinspection PyProtectedMember
+        self.assertTrue(session._conn.closed)
+
+    def test_release_after_pool_was_replaced(self):
+        with mock.patch('psycopg2.connect', lambda *args, **kwargs: FakeConnection()):
+            easypsyco.GlobalSession("dbname=test", pool_size=1)
+            session = easypsyco.GlobalSession.get()
+            self._in_thread(lambda: easypsyco.GlobalSession("dbname=other", pool_size=1))
+            easypsyco.GlobalSession.release()
+            # noinspection PyProtectedMember
+            self.assertTrue(session._conn.closed)
+            easypsyco.GlobalSession("dbname=test", pool_size=1)
+            self.assertIsNotNone(easypsyco.GlobalSession.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from psycopg2 import sql
+
+from easypsyco.easypsyco import insert
+
+
+class CopyCursor:
+    def __init__(self):
+        self.query = None
+        self.data = None
+
+    def copy_expert(self, sql, file):
+        self.query = sql
+        self.data = file.read()
+
+
+# noinspection SqlNoDataSourceInspection
+class InsertTestCase(unittest.TestCase):
+    def test_copy_insert(self):
+        cur = CopyCursor()
+        insert(cur, "table", [
+            {'a': 1, 'b': 'foo'},
+            {'a': None, 'b': 'say "hi"'},
+        ], copy=True)
+        self.assertEqual(sql.Composed([
+            sql.SQL('COPY '), sql.Identifier('table'),
+            sql.SQL(' ('), sql.Composed([sql.Identifier('a'), sql.SQL(','), sql.Identifier('b')]),
+            sql.SQL(') FROM STDIN WITH (FORMAT CSV)'),
+        ]), cur.query)
+        self.assertEqual('"1","foo"\n,"say ""hi"""\n', cur.data)
+
+    def test_copy_threshold(self):
+        cur = CopyCursor()
+        insert(cur, "table", [{'a': n} for n in range(1000)], copy_threshold=500)
+        self.assertEqual(''.join(f'"{n}"\n' for n in range(1000)), cur.data)
+
+    def test_copy_bool(self):
+        cur = CopyCursor()
+        insert(cur, "table", [{'a': True}, {'a': False}], copy=True)
+        self.assertEqual('true\nfalse\n', cur.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
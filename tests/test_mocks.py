@@ -23,6 +23,17 @@ class MockTestCase(unittest.TestCase):
                 results.append(f"{a} {b}")
         self.assertEqual(["foo bar"], results)
 
+    def test_first_matching_mock(self):
+        q = easypsyco.Queryable.mock({
+            "SELECT a FROM": [['a']],
+            "SELECT .* FROM": [['any']],
+        })
+        for query, expected in [("SELECT a FROM table", 'a'),
+                                ("SELECT b FROM table", 'any'),
+                                ("SELECT a FROM table", 'a')]:
+            with q.select(query) as rows:
+                self.assertEqual([[expected]], list(rows))
+
 
 if __name__ == '__main__':
     unittest.main()
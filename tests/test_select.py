@@ -0,0 +1,149 @@
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+
+import easypsyco
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+        self.query = None
+        self.args = None
+        self.rows = None
+
+    def execute(self, query, args=None):
+        self.query = query
+        self.args = args
+        self.connection.executed.append(query)
+        self.rows = self.connection.results.get(query)
+        if self.rows is not None:
+            self.rows = list(self.rows)
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        return iter(rows)
+
+    def fetchmany(self, size):
+        if self.rows is None:
+            raise psycopg2.ProgrammingError("no results to fetch")
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FakeConnectionInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.autocommit = False
+        self.executed = []
+        self.cursors = []
+        self.closed = False
+        self.info = FakeConnectionInfo()
+
+    def cursor(self, name=None):
+        cur = FakeCursor(self)
+        self.cursors.append(cur)
+        return cur
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def get_transaction_status(self):
+        return self.info.transaction_status
+
+    def close(self):
+        self.closed = True
+
+
+# noinspection SqlNoDataSourceInspection
+class SelectTestCase(unittest.TestCase):
+    def test_options_do_not_take_query_parameters(self):
+        query = "SELECT * FROM t WHERE arraysize = %(arraysize)s"
+        conn = FakeConnection({query: [(1,), (2,), (3,)]})
+        db = easypsyco.Database(lambda: conn)
+        with db.select(query, arraysize=7).configure(arraysize=2) as rows:
+            self.assertEqual([(1,), (2,), (3,)], list(rows))
+        self.assertEqual({'arraysize': 7}, conn.cursors[-1].args)
+
+    def test_stream_option(self):
+        query = "SELECT * FROM t WHERE stream = %(stream)s"
+        conn = FakeConnection({query: [(1,)]})
+        db = easypsyco.Database(lambda: conn)
+        with db.select(query, stream=False).configure(stream=True, itersize=10) as rows:
+            self.assertEqual([(1,)], list(rows))
+        self.assertEqual({'stream': False}, conn.cursors[-1].args)
+        self.assertEqual(10, conn.cursors[-1].itersize)
+
+    def test_readonly_option(self):
+        query = "SELECT * FROM t WHERE readonly = %(readonly)s"
+        conn = FakeConnection({query: [(1,)]})
+        db = easypsyco.Database(lambda: conn, autocommit_reads=True)
+        with db.select(query, readonly=False).configure(readonly=True) as rows:
+            self.assertEqual([(1,)], list(rows))
+            self.assertTrue(conn.autocommit)
+        self.assertEqual({'readonly': False}, conn.cursors[-1].args)
+        self.assertFalse(conn.autocommit)
+
+    def test_select_inside_select(self):
+        conn = FakeConnection({
+            "SELECT outer": [(1,), (2,)],
+            "SELECT inner": [('a',)],
+        })
+        results = []
+        with easypsyco.Database(lambda: conn) as session:
+            with session as transaction:
+                with transaction.select("SELECT outer").configure(arraysize=1) as outer:
+                    for row in outer:
+                        with transaction.select("SELECT inner") as inner:
+                            results.append((row, list(inner)))
+        self.assertEqual([((1,), [('a',)]), ((2,), [('a',)])], results)
+
+    def test_execute_inside_select(self):
+        conn = FakeConnection({"SELECT outer": [(1,), (2,)]})
+        results = []
+        with easypsyco.Database(lambda: conn) as session:
+            with session as transaction:
+                with transaction.select("SELECT outer").configure(arraysize=1) as outer:
+                    for row in outer:
+                        transaction.execute("UPDATE t SET x = %s", row)
+                        results.append(row)
+        self.assertEqual([(1,), (2,)], results)
+        self.assertTrue(all(cur.closed for cur in conn.cursors))
+
+    def test_exit_errors_are_chained(self):
+        class Failing:
+            def __init__(self, error):
+                self.error = error
+                self.exited = False
+
+            def __exit__(self, exc_type, exc_val, exc_tb):
+                self.exited = True
+                raise self.error
+
+        first, second = Failing(KeyError('cursor')), Failing(ValueError('session'))
+        select = easypsyco.Database(FakeConnection).select("SELECT 1")
+        # noinspection PyProtectedMember
+        select._stack = [second, first]
+        with self.assertRaises(ValueError) as context:
+            select.__exit__(None, None, None)
+        self.assertTrue(first.exited and second.exited)
+        self.assertIs(first.error, context.exception.__context__)
+
+
+if __name__ == '__main__':
+    unittest.main()
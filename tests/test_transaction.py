@@ -0,0 +1,52 @@
+import unittest
+
+from easypsyco import Transaction
+
+from .test_select import FakeConnection
+
+
+# noinspection SqlNoDataSourceInspection
+class PreparedTestCase(unittest.TestCase):
+    def test_placeholders(self):
+        conn = FakeConnection()
+        transaction = Transaction(conn)
+        statement = transaction.prepared("SELECT * FROM t WHERE a = %s AND b LIKE 'x%%' AND c = %s")
+        name = statement.split('(')[0][len('EXECUTE '):]
+        self.assertEqual(f"EXECUTE {name}(%s,%s)", statement)
+        self.assertEqual([f"PREPARE {name} AS SELECT * FROM t WHERE a = $1 AND b LIKE 'x%' AND c = $2"],
+                         conn.executed)
+
+    def test_without_placeholders(self):
+        conn = FakeConnection()
+        statement = Transaction(conn).prepared("SELECT 1")
+        self.assertNotIn('(', statement)
+        self.assertEqual([statement.replace('EXECUTE', 'PREPARE') + ' AS SELECT 1'], conn.executed)
+
+    def test_prepared_once_per_connection(self):
+        conn = FakeConnection()
+        first = Transaction(conn).prepared("SELECT %s")
+        second = Transaction(conn).prepared("SELECT %s")
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(conn.executed))
+        Transaction(FakeConnection()).prepared("SELECT %s")
+        self.assertEqual(1, len(conn.executed))
+
+    def test_named_placeholders_are_rejected(self):
+        conn = FakeConnection()
+        with self.assertRaises(ValueError):
+            Transaction(conn).prepared("SELECT %(a)s")
+        self.assertEqual([], conn.executed)
+
+    def test_prepared_inside_select(self):
+        conn = FakeConnection({"SELECT outer": [(1,), (2,)]})
+        transaction = Transaction(conn)
+        results = []
+        with transaction.select("SELECT outer").configure(arraysize=1) as rows:
+            for row in rows:
+                transaction.prepared("UPDATE t SET x = %s")
+                results.append(row)
+        self.assertEqual([(1,), (2,)], results)
+
+
+if __name__ == '__main__':
+    unittest.main()